@@ -0,0 +1,88 @@
+# deadline.py
+"""
+1 回の実行全体の締め切り（ラン予算）
+
+- post.py --deadline 90s / RUN_DEADLINE=90s で指定（未指定なら無制限＝従来どおり）
+- 各ステージは上限（cap）と、後段のために残しておく秒数（reserve）から持ち時間を決める
+- ツイート送信は途中でキャンセルしない。開始前に予算を確認するだけにする
+"""
+
+import asyncio
+import math
+import os
+import re
+import time
+from typing import Awaitable, Optional, TypeVar
+
+T = TypeVar("T")
+
+# ステージごとの持ち時間の上限（秒）
+STAGE_SSM = 15.0
+STAGE_PICK = 20.0
+STAGE_NEAR_DUP = 30.0
+# X API のタイムアウト（接続, 読み込み）。X の呼び出し 1 回はこの合計まで掛かりうる
+X_CONNECT_TIMEOUT = float(os.getenv("X_CONNECT_TIMEOUT", "5"))
+X_READ_TIMEOUT = float(os.getenv("X_READ_TIMEOUT", "30"))
+# ツイート開始に必要な残り時間（X の呼び出し 1 回分）と、送信後の Notion 更新 1 回分に確保する時間
+TWEET_MIN = X_CONNECT_TIMEOUT + X_READ_TIMEOUT
+MARK_RESERVE = 10.0
+# 予算がこれを下回ったら、必須でない処理（DEBUG スキャン・近似重複チェック）を省く
+LOW_BUDGET = 30.0
+
+class DeadlineExceeded(Exception):
+    pass
+
+_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600}
+
+def parse_duration(spec: str) -> float:
+    """'90s' / '2m' / '90' を秒数に変換"""
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smh]?)\s*", spec.lower())
+    if not m:
+        raise ValueError(f"invalid duration: {spec!r}")
+    return float(m.group(1)) * _UNITS[m.group(2)]
+
+class Deadline:
+    def __init__(self, seconds: Optional[float] = None):
+        self._end = time.monotonic() + seconds if seconds is not None else math.inf
+
+    @classmethod
+    def parse(cls, spec: Optional[str]) -> "Deadline":
+        return cls(parse_duration(spec) if spec else None)
+
+    @property
+    def unlimited(self) -> bool:
+        return self._end == math.inf
+
+    def remaining(self) -> float:
+        return max(0.0, self._end - time.monotonic())
+
+    def low(self) -> bool:
+        return self.remaining() < LOW_BUDGET
+
+    def budget(self, cap: float, reserve: float = 0.0, floor: float = 0.0) -> Optional[float]:
+        """
+        ステージの持ち時間（秒）。無制限なら None。
+        floor は必須処理（投稿後の Notion 更新など）に予算切れでも与える最低時間。
+        """
+        if self.unlimited:
+            return None
+        return max(floor, min(cap, self.remaining() - reserve))
+
+    async def run(
+        self,
+        aw: Awaitable[T],
+        stage: str,
+        cap: float,
+        reserve: float = 0.0,
+        floor: float = 0.0,
+    ) -> T:
+        """aw を持ち時間内で実行し、超えたらキャンセルして DeadlineExceeded を送出"""
+        timeout = self.budget(cap, reserve, floor)
+        if timeout is not None and timeout <= 0:
+            if asyncio.iscoroutine(aw):
+                aw.close()
+            raise DeadlineExceeded(f"{stage}: 予算切れのため開始しません")
+        try:
+            return await asyncio.wait_for(aw, timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"{stage}: {timeout:.1f}s 以内に終わりませんでした") from None
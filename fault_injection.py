@@ -0,0 +1,508 @@
+# fault_injection.py
+"""
+Notion / X / SSM 呼び出しへの障害・遅延注入
+
+- FAULT_PROFILE にプロファイル名（PROFILES のキー）、JSON ファイルのパス、または JSON 文字列を指定すると有効になる
+- FAULT_OFFLINE=true なら実サービスの代わりにメモリ上のフェイク（FakeNotion / FakeX / FakeSSM）を使う
+- FAULT_SEED で乱数を固定できる
+
+プロファイルはサービス（notion / x / ssm）ごとに以下を持つ:
+  latency:       {"median": 秒, "sigma": 対数正規の広がり}（sigma=0 で固定値）
+  error_rate:    errors（HTTP ステータスのリスト）のいずれかを返す確率
+  throttle_rate: 429（Retry-After 付き）を返す確率
+  retry_after:   429 の Retry-After 秒
+  truncate_rate: レスポンス本文が途中で切れる確率（リクエスト自体はサーバ側で処理される）
+"""
+
+import asyncio
+import datetime
+import functools
+import inspect
+import json
+import math
+import os
+import random
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+PROFILES: Dict[str, Dict[str, Dict[str, Any]]] = {
+    "none": {},
+    "notion_throttled": {
+        "notion": {"latency": {"median": 0.3, "sigma": 0.5}, "throttle_rate": 0.3, "retry_after": 1},
+    },
+    "notion_flaky": {
+        "notion": {"latency": {"median": 0.3, "sigma": 0.8}, "error_rate": 0.2, "errors": [502, 503]},
+    },
+    "ssm_throttled": {
+        "ssm": {"latency": {"median": 0.1, "sigma": 0.3}, "throttle_rate": 0.5},
+    },
+    "x_slow": {
+        "x": {"latency": {"median": 3.0, "sigma": 0.7}},
+    },
+    "degraded": {
+        "notion": {"latency": {"median": 0.5, "sigma": 1.0}, "throttle_rate": 0.1,
+                   "error_rate": 0.05, "errors": [502], "truncate_rate": 0.02},
+        "ssm": {"latency": {"median": 0.2, "sigma": 0.5}, "throttle_rate": 0.1},
+        "x": {"latency": {"median": 1.5, "sigma": 0.8}, "error_rate": 0.05, "errors": [503]},
+    },
+}
+
+class Injector:
+    def __init__(self, profile: Dict[str, Dict[str, Any]], seed: Optional[int] = None):
+        self.profile = profile
+        self.rng = random.Random(seed)
+        # (サービス, 注入内容) ごとの回数。レポート用
+        self.counts: Counter = Counter()
+
+    def delay(self, service: str) -> float:
+        lat = self.profile.get(service, {}).get("latency")
+        if not lat:
+            return 0.0
+        median, sigma = float(lat.get("median", 0)), float(lat.get("sigma", 0))
+        return median * math.exp(self.rng.gauss(0, sigma)) if sigma else median
+
+    def fault(self, service: str) -> Optional[str]:
+        """今回の呼び出しで注入する障害（'throttle' / 'error:<status>' / 'truncate' / None）"""
+        spec = self.profile.get(service, {})
+        r = self.rng.random()
+        for kind, rate in (("throttle", spec.get("throttle_rate", 0)),
+                           ("error", spec.get("error_rate", 0)),
+                           ("truncate", spec.get("truncate_rate", 0))):
+            if r < rate:
+                if kind == "error":
+                    kind = f"error:{self.rng.choice(spec.get('errors') or [500])}"
+                self.counts[(service, kind)] += 1
+                return kind
+            r -= rate
+        return None
+
+    def retry_after(self, service: str) -> int:
+        return int(self.profile.get(service, {}).get("retry_after", 1))
+
+_injector: Optional[Injector] = None
+_configured = False
+
+def _load_profile(spec: str) -> Dict[str, Dict[str, Any]]:
+    if spec in PROFILES:
+        return PROFILES[spec]
+    if os.path.exists(spec):
+        with open(spec, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return json.loads(spec)
+
+def configure(profile: Optional[str] = None, seed: Optional[int] = None) -> Optional[Injector]:
+    """プロファイルを明示的に設定する（None なら無効化）。fault_bench から使う"""
+    global _injector, _configured
+    _configured = True
+    _injector = Injector(_load_profile(profile), seed) if profile else None
+    return _injector
+
+def injector() -> Optional[Injector]:
+    if not _configured:
+        seed = os.getenv("FAULT_SEED")
+        configure(os.getenv("FAULT_PROFILE") or None, int(seed) if seed else None)
+    return _injector
+
+def offline() -> bool:
+    return os.getenv("FAULT_OFFLINE", "false").lower() == "true"
+
+# --- 各サービスの障害を、実サービスが返すのと同じレスポンス・例外で表現する ---
+
+def _notion_error(inj: Injector, fault: str) -> Exception:
+    import httpx
+    from notion_client.errors import APIResponseError, APIErrorCode
+
+    if fault == "truncate":
+        return httpx.RemoteProtocolError("peer closed connection without sending complete message body (injected)")
+    if fault == "throttle":
+        resp = httpx.Response(429, headers={"retry-after": str(inj.retry_after("notion"))}, text="{}")
+        return APIResponseError(resp, "Rate limited (injected)", APIErrorCode.RateLimited)
+    status = int(fault.split(":")[1])
+    resp = httpx.Response(status, text="{}")
+    return APIResponseError(resp, f"HTTP {status} (injected)", APIErrorCode.InternalServerError)
+
+def _x_response(inj: Injector, fault: str, url: str) -> Any:
+    """X API が返すのと同じ形のエラーレスポンス（requests.Response）"""
+    import requests
+
+    status = 429 if fault == "throttle" else int(fault.split(":")[1])
+    resp = requests.Response()
+    resp.status_code = status
+    resp.reason = "injected"
+    resp.url = url
+    resp.headers["content-type"] = "application/json"
+    resp._content = json.dumps({"title": "injected", "detail": f"HTTP {status} (injected)"}).encode()
+    if status == 429:
+        resp.headers["x-rate-limit-reset"] = str(int(time.time()) + inj.retry_after("x"))
+    return resp
+
+def _x_error(inj: Injector, fault: str) -> Exception:
+    """フェイク用: _x_response を tweepy がするのと同じ例外に変換する"""
+    import tweepy
+
+    resp = _x_response(inj, fault, "https://api.twitter.com/2/tweets")
+    for status, exc in ((400, tweepy.BadRequest), (401, tweepy.Unauthorized), (403, tweepy.Forbidden),
+                        (404, tweepy.NotFound), (429, tweepy.TooManyRequests)):
+        if resp.status_code == status:
+            return exc(resp)
+    if resp.status_code >= 500:
+        return tweepy.TwitterServerError(resp)
+    return tweepy.HTTPException(resp)
+
+def _x_duplicate_error() -> Exception:
+    """同じ本文の再投稿に X が返す 403"""
+    import requests
+    import tweepy
+
+    resp = requests.Response()
+    resp.status_code = 403
+    resp.reason = "Forbidden"
+    resp._content = json.dumps({
+        "title": "Forbidden", "status": 403,
+        "detail": "You are not allowed to create a Tweet with duplicate content.",
+    }).encode()
+    return tweepy.Forbidden(resp)
+
+def _ssm_response(fault: str, url: str) -> Any:
+    """SSM（JSON プロトコル）が返すのと同じ形のエラーレスポンス。botocore がこれを解釈して再試行する"""
+    from botocore.awsrequest import AWSResponse, HeadersDict
+
+    code, status = ("ThrottlingException", 400) if fault == "throttle" else ("InternalServerError", int(fault.split(":")[1]))
+    body = json.dumps({"__type": code, "message": "injected"}).encode()
+
+    class _Raw:
+        def stream(self, **_: Any) -> Any:
+            yield body
+
+    headers = HeadersDict({"Content-Type": "application/x-amz-json-1.1", "x-amzn-RequestId": "injected"})
+    return AWSResponse(url, status, headers, _Raw())
+
+def _ssm_error(fault: str) -> Exception:
+    try:
+        from botocore.exceptions import ClientError
+    except ImportError:
+        class ClientError(Exception):  # type: ignore[no-redef]
+            def __init__(self, error_response: dict, operation_name: str):
+                super().__init__(f"{error_response['Error']['Code']} when calling {operation_name}")
+    code = "ThrottlingException" if fault == "throttle" else "InternalServerError"
+    return ClientError({"Error": {"Code": code, "Message": "injected"}}, "GetParameter")
+
+# --- ラッパー ---
+# 実クライアントには HTTP の送信直前で障害を差し込み、botocore の再試行や tweepy の例外変換をそのまま通す。
+# フェイクには送信層が無いので、API 呼び出しの単位で同じ結果（例外・再試行）を再現する。
+
+class _NotionProxy:
+    """AsyncClient の databases / pages 等のエンドポイント呼び出しに遅延と障害を挟む"""
+
+    def __init__(self, target: Any, inj: Injector):
+        self._target = target
+        self._inj = inj
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._target, name)
+        if name == "aclose" or name.startswith("_"):
+            return attr
+        if hasattr(attr, "parent"):  # databases / pages などのエンドポイント
+            return _NotionProxy(attr, self._inj)
+        if not callable(attr):
+            return attr
+
+        # notion_client のエンドポイントメソッドは通常の関数で、AsyncClient では awaitable を返す
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            await asyncio.sleep(self._inj.delay("notion"))
+            fault = self._inj.fault("notion")
+            if fault and fault != "truncate":
+                raise _notion_error(self._inj, fault)
+            res = attr(*args, **kwargs)
+            res = await res if inspect.isawaitable(res) else res
+            if fault == "truncate":
+                # リクエストは処理された（作成・更新済み）が、応答の本文が途中で切れた
+                raise _notion_error(self._inj, fault)
+            return res
+        return call
+
+def _read_timeout(timeout: Any) -> Optional[float]:
+    return timeout[1] if isinstance(timeout, tuple) else timeout
+
+def _wrap_x_session(session: Any, inj: Injector) -> None:
+    """
+    tweepy.Client.session.request を差し替え、応答の代わりにエラーレスポンスを返す。
+    遅延が読み込みタイムアウトを超えれば requests と同じく ReadTimeout、
+    truncate は実際に送信した上で本文を途中で切る（送信済みなのに ID が読めない状況）。
+    """
+    import requests
+
+    send = session.request
+
+    def request(method: str, url: str, *args: Any, **kwargs: Any) -> Any:
+        delay = inj.delay("x")
+        timeout = _read_timeout(kwargs.get("timeout"))
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise requests.exceptions.ReadTimeout(f"Read timed out. (read timeout={timeout}) (injected)")
+        time.sleep(delay)
+        fault = inj.fault("x")
+        if fault and fault != "truncate":
+            return _x_response(inj, fault, url)
+        resp = send(method, url, *args, **kwargs)
+        if fault == "truncate":
+            resp._content = resp.content[:len(resp.content) // 2]
+        return resp
+
+    session.request = request
+
+class _XProxy:
+    """フェイク用: create_tweet の単位で遅延と障害を挟む"""
+
+    def __init__(self, target: Any, inj: Injector):
+        self._target = target
+        self._inj = inj
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._target, name)
+
+    def create_tweet(self, *args: Any, **kwargs: Any) -> Any:
+        import requests
+
+        time.sleep(self._inj.delay("x"))
+        fault = self._inj.fault("x")
+        if fault == "truncate":
+            # 実クライアントと同じく、投稿は済んだが応答が読めない
+            self._target.create_tweet(*args, **kwargs)
+            raise requests.exceptions.JSONDecodeError("Unterminated string (injected)", "", 0)
+        if fault:
+            raise _x_error(self._inj, fault)
+        return self._target.create_tweet(*args, **kwargs)
+
+def _ssm_before_send(inj: Injector, read_timeout: Optional[float], request: Any, **_: Any) -> Any:
+    """
+    botocore の before-send イベント。AWSResponse を返すと実際の送信の代わりにそれが使われ、
+    ThrottlingException などは botocore の再試行（standard モード）の対象になる。
+    """
+    from botocore.exceptions import ConnectionClosedError, ReadTimeoutError
+
+    delay = inj.delay("ssm")
+    if read_timeout is not None and delay > read_timeout:
+        time.sleep(read_timeout)
+        raise ReadTimeoutError(endpoint_url=request.url)
+    time.sleep(delay)
+    fault = inj.fault("ssm")
+    if fault == "truncate":
+        raise ConnectionClosedError(endpoint_url=request.url)
+    return _ssm_response(fault, request.url) if fault else None
+
+class _SSMProxy:
+    """フェイク用: get_parameter の単位で遅延と障害を挟み、botocore と同じく 2 回まで試す"""
+
+    ATTEMPTS = 2  # parameter_store.SSM_TOTAL_ATTEMPTS と同じ
+
+    def __init__(self, target: Any, inj: Injector):
+        self._target = target
+        self._inj = inj
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._target, name)
+
+    def get_parameter(self, *args: Any, **kwargs: Any) -> Any:
+        for attempt in range(self.ATTEMPTS):
+            time.sleep(self._inj.delay("ssm"))
+            fault = self._inj.fault("ssm")
+            if not fault:
+                return self._target.get_parameter(*args, **kwargs)
+            if attempt == self.ATTEMPTS - 1:
+                raise _ssm_error(fault)
+            time.sleep(self._inj.rng.random())  # standard モードの再試行待ち（最大 1 秒）
+
+def wrap_notion(client: Any) -> Any:
+    inj = injector()
+    return _NotionProxy(client, inj) if inj else client
+
+def wrap_x(client: Any) -> Any:
+    """tweepy.Client ならセッションに、フェイクなら create_tweet に障害を差し込む"""
+    inj = injector()
+    if not inj:
+        return client
+    if hasattr(client, "session"):
+        _wrap_x_session(client.session, inj)
+        return client
+    return _XProxy(client, inj)
+
+def wrap_ssm(client: Any) -> Any:
+    """boto3 のクライアントなら before-send イベントに、フェイクなら get_parameter に障害を差し込む"""
+    inj = injector()
+    if not inj:
+        return client
+    meta = getattr(client, "meta", None)
+    if meta is not None and hasattr(meta, "events"):
+        meta.events.register(
+            "before-send.ssm", functools.partial(_ssm_before_send, inj, meta.config.read_timeout),
+        )
+        return client
+    return _SSMProxy(client, inj)
+
+# --- オフライン用フェイク ---
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def _parse_date(s: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(s.replace("Z", "+00:00"))
+
+def _match(page: dict, cond: dict) -> bool:
+    """Notion のフィルタのうち、このボットが使う条件だけを評価する"""
+    if "and" in cond:
+        return all(_match(page, c) for c in cond["and"])
+    if "or" in cond:
+        return any(_match(page, c) for c in cond["or"])
+    if "timestamp" in cond:
+        value, spec = _parse_date(page[cond["timestamp"]]), cond[cond["timestamp"]]
+        if "on_or_after" in spec and value < _parse_date(spec["on_or_after"]):
+            return False
+        return not ("on_or_before" in spec and value > _parse_date(spec["on_or_before"]))
+    prop = page["properties"].get(cond["property"]) or {}
+    if "select" in cond:
+        name = (prop.get("select") or {}).get("name")
+        if "equals" in cond["select"]:
+            return name == cond["select"]["equals"]
+        return name is not None
+    if "rich_text" in cond:
+        text = "".join(x.get("plain_text", "") for x in prop.get("rich_text") or [])
+        return text == cond["rich_text"]["equals"]
+    if "date" in cond:
+        start = (prop.get("date") or {}).get("start")
+        if cond["date"].get("is_empty"):
+            return start is None
+        if "on_or_before" in cond["date"]:
+            return start is not None and _parse_date(start) <= _parse_date(cond["date"]["on_or_before"])
+    return True
+
+def _to_response(value: Any) -> Any:
+    """書き込み用のプロパティ値を、読み出し時の形（plain_text 付き）に揃える"""
+    if isinstance(value, dict) and "rich_text" in value:
+        return {"rich_text": [{"plain_text": x["text"]["content"], **x} for x in value["rich_text"]]}
+    return value
+
+class _FakeDatabases:
+    def __init__(self, db: "FakeNotion"):
+        self.parent = db
+        self._db = db
+
+    async def query(self, database_id: str, filter: Optional[dict] = None, sorts: Optional[list] = None,
+                    page_size: int = 100, start_cursor: Optional[str] = None, **_: Any) -> dict:
+        rs = [p for p in self._db.items if not p["archived"] and (not filter or _match(p, filter))]
+        for s in reversed(sorts or []):
+            def key(p: dict, s: dict = s) -> tuple:
+                if "timestamp" in s:
+                    return (False, p[s["timestamp"]])
+                start = ((p["properties"].get(s["property"]) or {}).get("date") or {}).get("start")
+                return (start is None, start or "")
+            rs.sort(key=key, reverse=s.get("direction") == "descending")
+        i = int(start_cursor or 0)
+        more = i + page_size < len(rs)
+        return {"results": rs[i:i + page_size], "has_more": more,
+                "next_cursor": str(i + page_size) if more else None}
+
+class _FakePages:
+    def __init__(self, db: "FakeNotion"):
+        self.parent = db
+        self._db = db
+
+    async def create(self, parent: dict, properties: dict, **_: Any) -> dict:
+        page = {"id": f"page-{len(self._db.items) + 1}", "archived": False,
+                "created_time": _now().isoformat(), "last_edited_time": _now().isoformat(),
+                "properties": {k: _to_response(v) for k, v in properties.items()}}
+        self._db.items.append(page)
+        return page
+
+    async def update(self, page_id: str, properties: Optional[dict] = None,
+                     archived: Optional[bool] = None, **_: Any) -> dict:
+        page = self._db.by_id(page_id)
+        for k, v in (properties or {}).items():
+            page["properties"][k] = _to_response(v)
+        if archived is not None:
+            page["archived"] = archived
+        page["last_edited_time"] = _now().isoformat()
+        return page
+
+class FakeNotion:
+    """AsyncClient 互換のメモリ上の投稿キュー（ready のページを n 件入れた状態で始まる）"""
+
+    def __init__(self, n: int = 50, content_prop: str = "Text"):
+        self.items: List[dict] = []
+        self.databases = _FakeDatabases(self)
+        self.pages = _FakePages(self)
+        for i in range(n):
+            self.items.append({
+                "id": f"page-{i + 1}", "archived": False,
+                "created_time": _now().isoformat(), "last_edited_time": _now().isoformat(),
+                "properties": {
+                    content_prop: {"rich_text": [{"plain_text": f"オフライン投稿 {i + 1} の本文です。"}]},
+                    "Status": {"select": {"name": "ready"}},
+                    "ScheduledAt": {"date": None},
+                },
+            })
+
+    def by_id(self, page_id: str) -> dict:
+        for p in self.items:
+            if p["id"] == page_id:
+                return p
+        raise KeyError(page_id)
+
+    async def aclose(self) -> None:
+        pass
+
+class _Resp:
+    def __init__(self, data: Any):
+        self.data = data
+
+class FakeX:
+    USER_ID = "1"
+
+    def __init__(self) -> None:
+        self.tweets: List[dict] = []
+
+    def create_tweet(self, text: str, **kwargs: Any) -> _Resp:
+        if any(t["text"] == text for t in self.tweets):
+            raise _x_duplicate_error()
+        data = {"id": str(10**18 + len(self.tweets)), "text": text, **kwargs}
+        self.tweets.append(data)
+        return _Resp(data)
+
+    def get_me(self, **_: Any) -> _Resp:
+        return _Resp(SimpleNamespace(id=self.USER_ID))
+
+    def get_users_tweets(self, id: str, max_results: int = 10, since_id: Optional[str] = None, **_: Any) -> _Resp:
+        """新しい順。返信は referenced_tweets に replied_to を持つ（tweepy.Tweet と同じ属性名）"""
+        found = [
+            SimpleNamespace(
+                id=t["id"], text=t["text"],
+                referenced_tweets=[SimpleNamespace(type="replied_to", id=t["in_reply_to_tweet_id"])]
+                if t.get("in_reply_to_tweet_id") else None,
+            )
+            for t in reversed(self.tweets) if not since_id or int(t["id"]) > int(since_id)
+        ]
+        return _Resp(found[:max_results])
+
+class FakeSSM:
+    def get_parameter(self, Name: str, **_: Any) -> dict:
+        return {"Parameter": {"Value": json.dumps({"access_token": "offline-access-token"})}}
+
+# オフライン時はプロセス内で 1 つの状態を共有する（run をまたいでキューが減っていく）
+_fakes: Dict[str, Any] = {}
+
+def fake_notion() -> Any:
+    if "notion" not in _fakes:
+        _fakes["notion"] = FakeNotion(int(os.getenv("FAULT_OFFLINE_PAGES", "50")),
+                                      os.getenv("NOTION_CONTENT_PROP", "Text"))
+    return _fakes["notion"]
+
+def fake_x() -> Any:
+    return _fakes.setdefault("x", FakeX())
+
+def fake_ssm() -> Any:
+    return _fakes.setdefault("ssm", FakeSSM())
+
+def reset_fakes() -> None:
+    _fakes.clear()
@@ -0,0 +1,145 @@
+# notion_bulk.py
+"""
+Notion への大量書き込み用の共通部品
+
+- 429 / 5xx / タイムアウト時に Retry-After を尊重して再試行
+- 同時実行数を絞ったワーカープール（入力はストリームのまま流す）
+- 再実行時に続きから再開するためのチェックポイントファイル
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, AsyncIterable, Awaitable, Callable, Iterable, Optional, Set, Union
+
+from notion_client.errors import APIResponseError, HTTPResponseError, RequestTimeoutError
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = int(os.getenv("NOTION_MAX_RETRIES", "5"))
+BASE_BACKOFF = float(os.getenv("NOTION_BACKOFF_SECONDS", "1.0"))
+
+# 429 を受けたら全ワーカーでこの時刻まで待つ（time.monotonic 基準）
+_cooldown_until = 0.0
+
+def _retry_after(e: Exception) -> Optional[float]:
+    headers = getattr(e, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def _is_retryable(e: Exception, idempotent: bool = True) -> bool:
+    status = getattr(e, "status", None) if isinstance(e, (APIResponseError, HTTPResponseError)) else None
+    if not idempotent:
+        # 429 はサーバ側で処理されていないので安全に再送できるが、
+        # タイムアウトや 5xx はサーバ側で作成済みの可能性があり、再送すると重複する
+        return status == 429
+    if isinstance(e, RequestTimeoutError):
+        return True
+    return status in RETRY_STATUSES
+
+async def call_with_retry(
+    fn: Callable[..., Awaitable[Any]],
+    *args: Any,
+    idempotent: bool = True,
+    **kwargs: Any,
+) -> Any:
+    """
+    Notion API 呼び出しを再試行付きで実行する。
+    Retry-After があればその秒数、なければ指数バックオフ＋ジッタで待つ。
+    pages.create のような冪等でない呼び出しは idempotent=False にし、429 のときだけ再試行する。
+    """
+    global _cooldown_until
+    attempt = 0
+    while True:
+        wait = _cooldown_until - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            if not _is_retryable(e, idempotent) or attempt >= MAX_RETRIES:
+                raise
+            delay = _retry_after(e)
+            if delay is None:
+                delay = BASE_BACKOFF * (2 ** attempt) + random.uniform(0, BASE_BACKOFF)
+            if getattr(e, "status", None) == 429:
+                _cooldown_until = max(_cooldown_until, time.monotonic() + delay)
+            attempt += 1
+            print(f"[WARN] Notion API 再試行 {attempt}/{MAX_RETRIES}（{delay:.1f}s 待機）: {e}", file=sys.stderr)
+            await asyncio.sleep(delay)
+
+async def run_bounded(
+    items: Union[Iterable[Any], AsyncIterable[Any]],
+    worker: Callable[[Any], Awaitable[None]],
+    concurrency: int = 3,
+) -> None:
+    """
+    items を concurrency 並列で worker に流す。
+    キューは concurrency*2 で頭打ちにし、入力全体をメモリに載せない。
+    """
+    queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=concurrency * 2)
+    done = object()
+
+    async def _consume() -> None:
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            await worker(item)
+
+    workers = [asyncio.create_task(_consume()) for _ in range(concurrency)]
+    try:
+        if hasattr(items, "__aiter__"):
+            async for item in items:  # type: ignore[union-attr]
+                await queue.put(item)
+        else:
+            for item in items:  # type: ignore[union-attr]
+                await queue.put(item)
+        for _ in workers:
+            await queue.put(done)
+        await asyncio.gather(*workers)
+    except BaseException:
+        for w in workers:
+            w.cancel()
+        raise
+
+class Checkpoint:
+    """
+    処理済みキーを 1 行ずつ追記するだけのチェックポイント。
+    途中で落ちても、書けた行までは次回スキップされる（書き込み途中で切れた行は読み飛ばす）。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        broken_tail = False
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    broken_tail = not line.endswith("\n")
+                    try:
+                        self.done.add(json.loads(line)["key"])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        self._f = open(path, "a", encoding="utf-8")
+        if broken_tail:
+            # 切れた行の続きに次のキーを書かないよう改行しておく
+            self._f.write("\n")
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.done
+
+    def add(self, key: str, **extra: Any) -> None:
+        self.done.add(key)
+        self._f.write(json.dumps({"key": key, **extra}, ensure_ascii=False) + "\n")
+        self._f.flush()
+
+    def close(self) -> None:
+        self._f.close()
@@ -1,14 +1,32 @@
 # notion_queue.py
 import datetime
+import hashlib
+import json
 import os
-from typing import Optional, Tuple, Dict, Any
+import sys
+import unicodedata
+from typing import Optional, Tuple, Dict, Any, AsyncIterator, Iterator, List
 
 from notion_client import AsyncClient
 
+import fault_injection
+from deadline import Deadline, STAGE_PICK, TWEET_MIN, MARK_RESERVE
+from notion_bulk import call_with_retry
+
 STATUS_READY = os.getenv("NOTION_STATUS_READY", "ready")
 STATUS_POSTED = os.getenv("NOTION_STATUS_POSTED", "posted")
+STATUS_DUPLICATE = os.getenv("NOTION_STATUS_DUPLICATE", "duplicate")
+STATUS_RETRY = os.getenv("NOTION_STATUS_RETRY", "retry")
+STATUS_DEAD = os.getenv("NOTION_STATUS_DEAD", "dead")
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = int(os.getenv("RETRY_BASE_SECONDS", "1800"))         # 初回リトライまで 30 分
+RETRY_MAX_BACKOFF_SECONDS = int(os.getenv("RETRY_MAX_BACKOFF_SECONDS", "86400"))
 CONTENT_PROP = os.getenv("NOTION_CONTENT_PROP", "Text")  # 投稿内容のプロパティ名
 DEBUG_MODE = os.getenv("DEBUG_MODE", "false").lower() == "true"
+NOTION_TIMEOUT_SECONDS = float(os.getenv("NOTION_TIMEOUT_SECONDS", "20"))  # 1 リクエストあたり
+RICH_TEXT_LIMIT = 2000  # Notion の rich_text 1 要素あたりの上限文字数
+SIMILARITY_CACHE = os.getenv("SIMILARITY_CACHE", ".cache/similarity.npz")  # 近似重複検知の署名キャッシュ
+SIMILARITY_RESYNC_MARGIN_SECONDS = 120
 
 def _content_plain(props: dict) -> str:
     prop = props[CONTENT_PROP]
@@ -17,8 +35,98 @@ def _content_plain(props: dict) -> str:
     arr = prop["rich_text"]
     return "".join(x.get("plain_text", "") for x in arr).strip()
 
-async def pick_ready(notion_token: str, db_id: str) -> Tuple[AsyncClient, Optional[dict]]:
-    n = AsyncClient(auth=notion_token)
+def _parse_date(value: Optional[str]) -> Optional[datetime.datetime]:
+    """Notion の日付（'2025-11-01' / '2025-11-01T08:00:00.000+09:00' / '...Z'）を aware な datetime に"""
+    if not value:
+        return None
+    dt = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=datetime.timezone.utc)
+
+def _prop_date(props: dict, name: str) -> Optional[datetime.datetime]:
+    return _parse_date(((props.get(name) or {}).get("date") or {}).get("start"))
+
+class QueueItem:
+    """
+    投稿キューの 1 ページ。API レスポンスから必要な値だけを 1 度だけ取り出し、元の dict は保持しない。
+    """
+
+    __slots__ = (
+        "id", "text", "scheduled_at", "status", "last_edited",
+        "attachments", "attempts", "thread_ids",
+    )
+
+    def __init__(
+        self,
+        id: str,
+        text: str,
+        scheduled_at: Optional[datetime.datetime] = None,
+        status: Optional[str] = None,
+        last_edited: Optional[datetime.datetime] = None,
+        attachments: Tuple[str, ...] = (),
+        attempts: int = 0,
+        thread_ids: Tuple[str, ...] = (),
+    ):
+        self.id = id
+        self.text = text
+        self.scheduled_at = scheduled_at
+        self.status = status
+        self.last_edited = last_edited
+        self.attachments = attachments
+        self.attempts = attempts
+        self.thread_ids = thread_ids
+
+    @classmethod
+    def from_page(cls, page: dict) -> "QueueItem":
+        props = page.get("properties", {})
+        # files 型のプロパティはすべて添付とみなし、URL だけ持つ
+        attachments = tuple(
+            (f.get("file") or f.get("external") or {}).get("url", "")
+            for prop in props.values() if prop.get("type") == "files"
+            for f in prop.get("files") or []
+        )
+        thread_raw = "".join(x.get("plain_text", "") for x in (props.get("ThreadIds") or {}).get("rich_text") or [])
+        return cls(
+            id=page["id"],
+            text=_content_plain(props),
+            scheduled_at=_prop_date(props, "ScheduledAt"),
+            status=((props.get("Status") or {}).get("select") or {}).get("name"),
+            last_edited=_parse_date(page.get("last_edited_time")),
+            attachments=attachments,
+            attempts=int((props.get("Attempts") or {}).get("number") or 0),
+            thread_ids=tuple(x for x in thread_raw.split(",") if x.strip()),
+        )
+
+    def __repr__(self) -> str:
+        return f"QueueItem(id={self.id!r}, status={self.status!r}, scheduled_at={self.scheduled_at!r})"
+
+def open_client(notion_token: str) -> AsyncClient:
+    """
+    Notion クライアントを作る。FAULT_PROFILE があれば障害注入ラッパーを被せ、
+    FAULT_OFFLINE=true ならメモリ上のフェイクを使う（fault_injection.py）。
+    """
+    if fault_injection.offline():
+        n = fault_injection.fake_notion()
+    else:
+        n = AsyncClient(auth=notion_token, timeout_ms=int(NOTION_TIMEOUT_SECONDS * 1000))
+    return fault_injection.wrap_notion(n)
+
+async def pick_ready(
+    notion_token: str,
+    db_id: str,
+    deadline: Optional[Deadline] = None,
+) -> Tuple[AsyncClient, Optional[QueueItem]]:
+    deadline = deadline or Deadline()
+    n = open_client(notion_token)
+    try:
+        return n, await deadline.run(
+            _pick_ready(n, db_id, deadline),
+            "pick_ready", STAGE_PICK, reserve=TWEET_MIN + MARK_RESERVE,
+        )
+    except BaseException:
+        await n.aclose()
+        raise
+
+async def _pick_ready(n: AsyncClient, db_id: str, deadline: Deadline) -> Optional[QueueItem]:
     # 現在時刻をタイムゾーン付きの UTC にして、Z で明示
     now_iso = (
         datetime.datetime.now(datetime.timezone.utc)
@@ -31,8 +139,14 @@ async def pick_ready(notion_token: str, db_id: str) -> Tuple[AsyncClient, Option
     # より厳密なフィルター条件を構築
     filter_condition = {
         "and": [
-            # Statusが確実にreadyであることを確認
-            {"property": "Status", "select": {"equals": STATUS_READY}},
+            # Status が ready、または retry でバックオフが明けたもの
+            {"or": [
+                {"property": "Status", "select": {"equals": STATUS_READY}},
+                {"and": [
+                    {"property": "Status", "select": {"equals": STATUS_RETRY}},
+                    {"property": "NextAttemptAt", "date": {"on_or_before": now_iso}},
+                ]},
+            ]},
             # Status が空でないことも確認
             {"property": "Status", "select": {"is_not_empty": True}},
             {"or": [
@@ -41,11 +155,11 @@ async def pick_ready(notion_token: str, db_id: str) -> Tuple[AsyncClient, Option
             ]},
         ]
     }
-    print(f"🔍 DEBUG: フィルター条件 STATUS_READY='{STATUS_READY}'")
+    print(f"🔍 DEBUG: フィルター条件 STATUS_READY='{STATUS_READY}' STATUS_RETRY='{STATUS_RETRY}'")
     print(f"🔍 DEBUG: フィルター = {filter_condition}")
     
-    # さらなるデバッグ：すべてのページのStatusを確認（デバッグモード時のみ）
-    if DEBUG_MODE:
+    # さらなるデバッグ：すべてのページのStatusを確認（デバッグモード時のみ。予算が少なければ省略）
+    if DEBUG_MODE and not deadline.low():
         all_pages_query = await n.databases.query(
             database_id=db_id,
             page_size=10,
@@ -76,24 +190,244 @@ async def pick_ready(notion_token: str, db_id: str) -> Tuple[AsyncClient, Option
             print(f"🔍 DEBUG: 実際のStatus値 = '{actual_status}'")
             
             # 追加検証：Statusが期待値と一致しない場合は除外
-            if actual_status != STATUS_READY:
-                print(f"⚠️  WARNING: Status値が期待値と異なります。期待値='{STATUS_READY}', 実際='{actual_status}' - このページをスキップします。")
-                return n, None
+            if actual_status not in (STATUS_READY, STATUS_RETRY):
+                print(f"⚠️  WARNING: Status値が期待値と異なります。期待値='{STATUS_READY}'/'{STATUS_RETRY}', 実際='{actual_status}' - このページをスキップします。")
+                return None
     
-    return n, (rs[0] if rs else None)
-
-def page_text(page: dict) -> str:
-    return _content_plain(page["properties"])
-
-async def mark_posted(n: AsyncClient, page_id: str) -> None:
-    await n.pages.update(
-        page_id=page_id,
-        properties={
-            "Status": {"select": {"name": STATUS_POSTED}},
-            "PostedAt": {
-                "date": {
-                    "start": datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
-                }
-            },
+    return QueueItem.from_page(rs[0]) if rs else None
+
+def page_text(item: QueueItem) -> str:
+    return item.text
+
+async def mark_posted(
+    n: AsyncClient,
+    page_id: str,
+    deadline: Optional[Deadline] = None,
+    thread_ids: Optional[List[str]] = None,
+) -> None:
+    # 投稿済みの記録は必須処理なので、予算切れでも MARK_RESERVE 秒は待つ
+    await (deadline or Deadline()).run(
+        _update_posted(n, page_id, thread_ids), "mark_posted", MARK_RESERVE, floor=MARK_RESERVE,
+    )
+
+async def _update_posted(n: AsyncClient, page_id: str, thread_ids: Optional[List[str]] = None) -> None:
+    properties: Dict[str, Any] = {
+        "Status": {"select": {"name": STATUS_POSTED}},
+        "PostedAt": {
+            "date": {
+                "start": datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+            }
         },
+    }
+    if thread_ids:
+        properties["ThreadIds"] = {"rich_text": _rich_text(",".join(thread_ids))}
+    await n.pages.update(page_id=page_id, properties=properties)
+
+async def save_thread_progress(n: AsyncClient, page_id: str, thread_ids: List[str], deadline: Optional[Deadline] = None) -> None:
+    """
+    投稿済みセグメント ID を都度保存する。途中で失敗しても次回は続きのセグメントから再開できる。
+    送信済みの ID を失わないよう、429 / 5xx / タイムアウトは再試行し、mark_posted と同じく予算切れでも MARK_RESERVE 秒は待つ。
+    """
+    await (deadline or Deadline()).run(
+        call_with_retry(
+            n.pages.update,
+            page_id=page_id,
+            properties={"ThreadIds": {"rich_text": _rich_text(",".join(thread_ids))}},
+        ),
+        "save_thread_progress", MARK_RESERVE, floor=MARK_RESERVE,
+    )
+
+async def mark_failed(
+    n: AsyncClient,
+    item: QueueItem,
+    error: str,
+    deadline: Optional[Deadline] = None,
+) -> Tuple[str, int]:
+    """
+    投稿失敗をページに記録し、retry（バックオフ付き）か dead に移す。
+    バックオフは RETRY_BASE_SECONDS * 2^(試行回数-1)（上限 RETRY_MAX_BACKOFF_SECONDS）。
+    mark_posted と同じく予算切れでも MARK_RESERVE 秒は待つ。
+    戻り値: (新しい Status, 試行回数)
+    """
+    attempts = item.attempts + 1
+    now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    properties: Dict[str, Any] = {
+        "Attempts": {"number": attempts},
+        "LastError": {"rich_text": _rich_text(error[:RICH_TEXT_LIMIT])},
+    }
+    if attempts >= RETRY_MAX_ATTEMPTS:
+        status = STATUS_DEAD
+        properties["NextAttemptAt"] = {"date": None}
+    else:
+        status = STATUS_RETRY
+        delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_BACKOFF_SECONDS)
+        next_at = now + datetime.timedelta(seconds=delay)
+        properties["NextAttemptAt"] = {"date": {"start": next_at.isoformat().replace("+00:00", "Z")}}
+    properties["Status"] = {"select": {"name": status}}
+    await (deadline or Deadline()).run(
+        n.pages.update(page_id=item.id, properties=properties), "mark_failed", MARK_RESERVE, floor=MARK_RESERVE,
+    )
+    return status, attempts
+
+async def archive_page(n: AsyncClient, page_id: str) -> None:
+    """ページを Notion 上でアーカイブ（ゴミ箱へ移動）し、DB クエリの対象から外す"""
+    await n.pages.update(page_id=page_id, archived=True)
+
+def content_hash(text: str) -> str:
+    """重複判定用の本文ハッシュ（NFKC 正規化＋前後空白除去した上で SHA-256）"""
+    norm = unicodedata.normalize("NFKC", text).strip()
+    return hashlib.sha256(norm.encode("utf-8")).hexdigest()
+
+def _rich_text(text: str) -> List[Dict[str, Any]]:
+    return [
+        {"type": "text", "text": {"content": text[i:i + RICH_TEXT_LIMIT]}}
+        for i in range(0, len(text), RICH_TEXT_LIMIT)
+    ]
+
+async def iter_pages(
+    n: AsyncClient,
+    db_id: str,
+    filter: Optional[dict] = None,
+    sorts: Optional[list] = None,
+) -> AsyncIterator[dict]:
+    """データベースのページを 100 件ずつ取得しながら 1 件ずつ返す"""
+    cursor: Optional[str] = None
+    while True:
+        kwargs: Dict[str, Any] = {"database_id": db_id, "page_size": 100}
+        if filter:
+            kwargs["filter"] = filter
+        if sorts:
+            kwargs["sorts"] = sorts
+        if cursor:
+            kwargs["start_cursor"] = cursor
+        q = await call_with_retry(n.databases.query, **kwargs)
+        for page in q.get("results", []):
+            yield page
+        if not q.get("has_more"):
+            return
+        cursor = q.get("next_cursor")
+
+async def iter_items(n: AsyncClient, db_id: str, filter: Optional[dict] = None) -> AsyncIterator[QueueItem]:
+    """iter_pages の QueueItem 版。本文プロパティが無い・型が違うページは飛ばす"""
+    async for page in iter_pages(n, db_id, filter=filter):
+        try:
+            yield QueueItem.from_page(page)
+        except (KeyError, ValueError):
+            continue
+
+def iter_archived_pages(path: str) -> Iterator[dict]:
+    """
+    tools/archive_posted.py が書き出した JSONL（ページ JSON 1 行）を 1 件ずつ読む。
+    書き込み途中で落ちた行など、読めない行は飛ばす。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                page = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(page, dict) and "id" in page:
+                yield page
+
+def iter_archived_items(path: str) -> Iterator[QueueItem]:
+    """iter_archived_pages の QueueItem 版"""
+    for page in iter_archived_pages(path):
+        try:
+            yield QueueItem.from_page(page)
+        except (KeyError, ValueError):
+            continue
+
+async def create_page(
+    n: AsyncClient,
+    db_id: str,
+    text: str,
+    scheduled_at: Optional[str] = None,
+    status: str = STATUS_READY,
+    posted_at: Optional[str] = None,
+    source_id: Optional[str] = None,
+) -> dict:
+    properties: Dict[str, Any] = {
+        CONTENT_PROP: {"rich_text": _rich_text(text)},
+        "Status": {"select": {"name": status}},
+    }
+    if scheduled_at:
+        properties["ScheduledAt"] = {"date": {"start": scheduled_at}}
+    if posted_at:
+        properties["PostedAt"] = {"date": {"start": posted_at}}
+    if source_id:
+        # アーカイブ用 DB へのコピーに元ページ ID を残す（tools/archive_posted.py の二重作成防止）
+        properties["SourceId"] = {"rich_text": _rich_text(source_id)}
+    return await n.pages.create(parent={"database_id": db_id}, properties=properties)
+
+async def load_similarity_index(
+    n: AsyncClient,
+    db_id: str,
+    threshold: float,
+    cache_path: Optional[str] = SIMILARITY_CACHE,
+):
+    """
+    近似重複検知用の LSHIndex（キーはページ ID）を返す。
+    署名は cache_path に保存しておき、前回の同期以降に編集されたページだけを取り直して反映する
+    （キャッシュが無い・壊れている・署名の作り方が変わったときは全件）。
+    posted / ready / retry のページを入れ、それ以外の Status に変わったページは外す。
+    アーカイブしたページはクエリに出てこないのでキャッシュに残り、過去の投稿との照合に使われ続ける。
+    numpy を使うのでここでだけ import する。
+    """
+    from similarity import LSHIndex
+
+    index = None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            index = LSHIndex.load(cache_path, threshold)
+        except Exception as e:
+            print(f"⚠️ 類似度キャッシュを読めないため作り直します（{cache_path}）: {e}", file=sys.stderr)
+    if index is None:
+        index = LSHIndex(threshold=threshold)
+
+    synced_at = index.meta.get("synced_at")
+    filter: Optional[dict] = None
+    if synced_at:
+        # last_edited_time は分単位に丸められるので、少し戻して取り直す（同じページの再反映は上書きになるだけ）
+        since = _parse_date(synced_at) - datetime.timedelta(seconds=SIMILARITY_RESYNC_MARGIN_SECONDS)
+        filter = {"timestamp": "last_edited_time",
+                  "last_edited_time": {"on_or_after": since.isoformat().replace("+00:00", "Z")}}
+    indexed = {STATUS_POSTED, STATUS_READY, STATUS_RETRY}
+    batch: List[Tuple[str, str]] = []
+    last_seen: Optional[str] = None
+    try:
+        # 編集の古い順に読むので、途中で打ち切られても読めたところまでを同期済みとして保存できる
+        async for page in iter_pages(
+            n, db_id, filter=filter, sorts=[{"timestamp": "last_edited_time", "direction": "ascending"}],
+        ):
+            last_seen = page.get("last_edited_time") or last_seen
+            try:
+                item = QueueItem.from_page(page)
+            except (KeyError, ValueError):
+                index.remove(page["id"])
+                continue
+            if item.status in indexed:
+                batch.append((item.id, item.text))
+            else:
+                index.remove(item.id)
+            if len(batch) >= 1000:
+                index.add_many(batch)
+                batch = []
+        index.add_many(batch)
+        batch = []
+    finally:
+        # 予算切れ（CancelledError）や API エラーで止まっても、反映済みの分は次回に持ち越す
+        if batch:
+            index.add_many(batch)
+        if cache_path and last_seen:
+            index.meta["synced_at"] = last_seen
+            try:
+                index.save(cache_path)
+            except OSError as e:
+                print(f"⚠️ 類似度キャッシュを保存できません（{cache_path}）: {e}", file=sys.stderr)
+    return index
+
+async def mark_status(n: AsyncClient, page_id: str, status: str, deadline: Optional[Deadline] = None) -> None:
+    await (deadline or Deadline()).run(
+        n.pages.update(page_id=page_id, properties={"Status": {"select": {"name": status}}}),
+        "mark_status", MARK_RESERVE, floor=MARK_RESERVE,
     )
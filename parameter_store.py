@@ -13,13 +13,37 @@ import json
 import sys
 from typing import Dict, Any, Optional
 
-def load_token_from_parameter_store(parameter_name: str, region: str = "ap-northeast-1") -> Dict[str, Any]:
+import fault_injection
+
+# timeout 指定時の botocore の試行回数（初回を含む）。standard モードの再試行待ちは 1 回あたり最大 1 秒
+SSM_TOTAL_ATTEMPTS = 2
+SSM_RETRY_BACKOFF_MAX = 1.0
+
+def _ssm_config(timeout: float):
+    """
+    再試行を含めた最悪ケース（試行回数 ×（接続 + 読み込み）+ 再試行待ち）が timeout に収まる botocore の Config
+    """
+    from botocore.config import Config
+
+    per_attempt = max(timeout - SSM_RETRY_BACKOFF_MAX * (SSM_TOTAL_ATTEMPTS - 1), 0.2) / SSM_TOTAL_ATTEMPTS
+    return Config(
+        connect_timeout=per_attempt / 2,
+        read_timeout=per_attempt / 2,
+        retries={"total_max_attempts": SSM_TOTAL_ATTEMPTS, "mode": "standard"},
+    )
+
+def load_token_from_parameter_store(
+    parameter_name: str,
+    region: str = "ap-northeast-1",
+    timeout: Optional[float] = None,
+) -> Dict[str, Any]:
     """
     AWS Parameter Store からトークンデータを読み込む
     
     Args:
         parameter_name: パラメータストアのパラメータ名
         region: AWSリージョン
+        timeout: 再試行を含めた全体の持ち時間（秒）。None なら botocore の既定値
         
     Returns:
         トークンデータの辞書
@@ -29,12 +53,18 @@ def load_token_from_parameter_store(parameter_name: str, region: str = "ap-north
         Exception: AWS API エラーやその他のエラー
     """
     try:
-        import boto3
-        from botocore.exceptions import ClientError, NoCredentialsError
-        
         print(f"[INFO] Parameter Store からトークン読み込み中... (region: {region})")
         
-        ssm = boto3.client('ssm', region_name=region)
+        if fault_injection.offline():
+            ssm = fault_injection.fake_ssm()
+        else:
+            import boto3
+            
+            if timeout is not None:
+                ssm = boto3.client('ssm', region_name=region, config=_ssm_config(timeout))
+            else:
+                ssm = boto3.client('ssm', region_name=region)
+        ssm = fault_injection.wrap_ssm(ssm)
         
         response = ssm.get_parameter(Name=parameter_name, WithDecryption=True)
         raw_value = response["Parameter"]["Value"].lstrip("\ufeff").strip()
@@ -1,11 +1,29 @@
-import asyncio, os, sys
-from typing import cast, Any
+import argparse, asyncio, json, os, sys
+from typing import cast, Any, List, Optional
 from config import get_notion_config
+from deadline import (
+    Deadline, DeadlineExceeded, STAGE_SSM, STAGE_NEAR_DUP, TWEET_MIN, MARK_RESERVE,
+    X_CONNECT_TIMEOUT, X_READ_TIMEOUT,
+)
 from oauth2_flow import ensure_token_interactive
-from x_api import client_from_access_token, create_text_tweet
-from notion_queue import pick_ready, page_text, mark_posted
+from x_api import (
+    client_from_access_token, create_text_tweet, find_sent_tweet, split_for_thread,
+    is_duplicate_error, is_rejected,
+)
+from notion_queue import (
+    pick_ready, page_text, mark_posted, mark_status, mark_failed, load_similarity_index,
+    save_thread_progress, QueueItem, STATUS_DUPLICATE, STATUS_DEAD,
+)
 from parameter_store import load_token_from_parameter_store
 
+# 近似重複の閾値（0〜1）。未設定なら近似重複チェックは行わない
+NEAR_DUP_THRESHOLD = os.getenv("NEAR_DUP_THRESHOLD")
+# スレッドの投稿済みセグメント ID の控え（Notion への保存に失敗しても ID を失わないように）
+THREAD_JOURNAL_DIR = os.getenv("THREAD_JOURNAL_DIR", ".cache/threads")
+
+class ThreadDuplicateError(Exception):
+    """スレッドの途中のセグメントが重複として拒否された（続きを返信できないのでページの失敗として扱う）"""
+
 def getenv_str(name: str) -> str:
     v = os.getenv(name)
     if not v:
@@ -13,7 +31,119 @@ def getenv_str(name: str) -> str:
         sys.exit(1)
     return v
 
-async def main():
+async def skip_near_duplicate(n, db_id: str, page_id: str, text: str, deadline: Deadline) -> bool:
+    """
+    posted / ready の既存本文と近似重複なら Status=duplicate にして True を返す。
+    チェック自体の失敗・予算切れでは投稿を止めない（警告のみ）。
+    """
+    if deadline.low():
+        print("⚠️ 残り予算が少ないため近似重複チェックを省略", file=sys.stderr)
+        return False
+    try:
+        index = await deadline.run(
+            load_similarity_index(n, db_id, float(cast(str, NEAR_DUP_THRESHOLD))),
+            "near_dup", STAGE_NEAR_DUP, reserve=TWEET_MIN + MARK_RESERVE,
+        )
+        hits = index.query(text, exclude=page_id)
+    except Exception as e:
+        print(f"⚠️ 近似重複チェックに失敗（投稿は続行）: {e}", file=sys.stderr)
+        return False
+    if not hits:
+        return False
+    dup_id, score = hits[0]
+    print(f"⚠️ 近似重複検知：{dup_id}（類似度 {score:.2f}）と重複のため {STATUS_DUPLICATE} に更新してスキップ")
+    await mark_status(n, page_id, STATUS_DUPLICATE, deadline)
+    return True
+
+def check_tweet_budget(deadline: Deadline, calls: int = 1, writes: int = 1) -> None:
+    """
+    X API を calls 回呼び、その後 Notion 更新を writes 回する時間が残っているかを開始前に確認する。
+    送信は開始したら最後まで待つ（途中で打ち切ると ID を失う）ので、確認は開始前にだけ行う。
+    """
+    need = calls * TWEET_MIN + writes * MARK_RESERVE
+    if not deadline.unlimited and deadline.remaining() < need:
+        raise DeadlineExceeded(f"tweet: 残り {deadline.remaining():.1f}s のため送信しません（必要 {need:.0f}s）")
+
+def _journal_path(page_id: str) -> str:
+    return os.path.join(THREAD_JOURNAL_DIR, f"{page_id}.json")
+
+def load_thread_journal(page_id: str) -> List[str]:
+    try:
+        with open(_journal_path(page_id), "r", encoding="utf-8") as f:
+            return [str(x) for x in json.load(f)]
+    except (OSError, ValueError):
+        return []
+
+def write_thread_journal(page_id: str, ids: List[str]) -> None:
+    try:
+        os.makedirs(THREAD_JOURNAL_DIR, exist_ok=True)
+        tmp = _journal_path(page_id) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(ids, f)
+        os.replace(tmp, _journal_path(page_id))
+    except OSError as e:
+        print(f"⚠️ スレッド進捗の控えを書けません: {e}", file=sys.stderr)
+
+def clear_thread_journal(page_id: str) -> None:
+    try:
+        os.remove(_journal_path(page_id))
+    except OSError:
+        pass
+
+def recover_segment(client, text: str, parent: Optional[str], deadline: Deadline, writes: int) -> Optional[str]:
+    """投稿済みセグメントの ID を X から探す（見つからない・探せないときは None）"""
+    check_tweet_budget(deadline, calls=2, writes=writes)
+    try:
+        return find_sent_tweet(client, text, in_reply_to=parent)
+    except Exception as e:
+        print(f"⚠️ 投稿済みセグメントの検索に失敗: {e}", file=sys.stderr)
+        return None
+
+async def post_thread(client, n, item: QueueItem, segments: List[str], deadline: Deadline) -> None:
+    """
+    segments を返信チェーンとして順に投稿する。
+    投稿済み ID はローカルの控えと ThreadIds に都度保存し、再実行時はその続きのセグメントから再開する
+    （Notion への保存に失敗しても、控えの方が進んでいればそちらから再開する）。
+    途中のセグメントが重複として拒否されたら、前回送信済みのものとして ID を探して続ける。
+    見つからなければ posted にはせず ThreadDuplicateError でページの失敗にする。
+    """
+    ids = list(item.thread_ids)
+    journal = load_thread_journal(item.id)
+    if len(journal) > len(ids) and journal[:len(ids)] == ids:
+        ids = journal
+    if ids:
+        print(f"🔁 スレッド再開：{len(ids)}/{len(segments)} セグメント投稿済み")
+    for i in range(len(ids), len(segments)):
+        # 送信後に save_thread_progress、最後のセグメントはさらに mark_posted
+        writes = 2 if i == len(segments) - 1 else 1
+        check_tweet_budget(deadline, writes=writes)
+        parent = ids[-1] if ids else None
+        try:
+            res = create_text_tweet(client, segments[i], in_reply_to=parent)
+        except Exception as e:
+            if not is_duplicate_error(e):
+                raise
+            # 前回の送信が届いたのに応答を受け取れなかった（読み込みタイムアウトなど）場合は、送信済みの ID を探して続ける
+            recovered = recover_segment(client, segments[i], parent, deadline, writes)
+            if not recovered:
+                raise ThreadDuplicateError(
+                    f"スレッド {i + 1}/{len(segments)} が重複として拒否されました（投稿済み {len(ids)} 件）: {e}"
+                ) from e
+            print(f"🔁 スレッド {i + 1}/{len(segments)} は投稿済みでした（ID を回収）")
+            res = {"id": recovered}
+        if not res.get("id"):
+            raise RuntimeError(f"スレッド {i + 1}/{len(segments)} の tweet_id が取得できず、続きを返信できません")
+        ids.append(res["id"])
+        # Notion より先にローカルへ控える（保存に失敗しても送信済みの ID は残る）
+        write_thread_journal(item.id, ids)
+        print(f"✅ スレッド {i + 1}/{len(segments)} 投稿成功 tweet_id = {res['id']}")
+        await save_thread_progress(n, item.id, ids, deadline)
+    await mark_posted(n, item.id, deadline, thread_ids=ids)
+    clear_thread_journal(item.id)
+
+async def main(deadline: Optional[Deadline] = None) -> str:
+    """1 件投稿する。戻り値は結果の種別（tools/fault_bench.py の集計用）"""
+    deadline = deadline or Deadline()
     # Notion の接続情報を取得
     notion = get_notion_config()
     notion_token = notion["token"]
@@ -23,42 +153,84 @@ async def main():
     # ここでは「SSM から読むだけ」に限定し、書き戻し・再認可は行わない
     ssm_param = os.getenv("SSM_PARAM_NAME", "/x-post-bot/token.json")
     region = os.getenv("AWS_REGION", "ap-northeast-1")
-    token = load_token_from_parameter_store(ssm_param, region)
+    ssm_budget = deadline.budget(STAGE_SSM, reserve=TWEET_MIN + MARK_RESERVE)
+    token = await deadline.run(
+        # 再試行込みで ssm_budget に収まるようタイムアウトを決める（打ち切っても裏のスレッドは終了まで残るため）
+        asyncio.to_thread(load_token_from_parameter_store, ssm_param, region, ssm_budget),
+        "ssm", STAGE_SSM, reserve=TWEET_MIN + MARK_RESERVE,
+    )
     access_token = token.get("access_token")
     if not access_token:
         print("❌ access_token が見つかりません。前段のリフレッシュに失敗している可能性があります。", file=sys.stderr)
         sys.exit(1)
-    client = client_from_access_token(access_token)
+    client = client_from_access_token(access_token, timeout=(X_CONNECT_TIMEOUT, X_READ_TIMEOUT))
 
     # Notion から 1 件取得
-    n, page = await pick_ready(notion_token, notion_db_id)
-    if not page:
+    n, item = await pick_ready(notion_token, notion_db_id, deadline)
+    if not item:
         print("⚠️ Notion: Status=ready の投稿が見つかりません。終了。")
-        return
+        await cast(Any, n).aclose()
+        return "no_item"
 
-    text = page_text(page)
+    text = page_text(item)
     if not text:
         print("⚠️ Notion: Text(Title) が空のためスキップ。")
-        return
+        await cast(Any, n).aclose()
+        return "empty"
 
     try:
+        if NEAR_DUP_THRESHOLD and await skip_near_duplicate(n, notion_db_id, item.id, text, deadline):
+            return "near_duplicate"
+
+        # 1 投稿に収まらない本文は文の区切りで分割し、スレッドとして投稿する
+        segments = split_for_thread(text)
+        if len(segments) > 1:
+            await post_thread(client, n, item, segments, deadline)
+            return "posted"
+
+        check_tweet_budget(deadline)
         res = create_text_tweet(client, text)
         if res.get("id"):
             print("✅ 投稿成功 tweet_id =", res["id"])
         else:
             print("✅ 投稿成功（ID取得できず）")
         # 投稿できたら posted に更新
-        await mark_posted(n, page["id"])
+        await mark_posted(n, item.id, deadline)
+        return "posted"
+    except DeadlineExceeded as e:
+        # ページ自体の失敗ではないので retry には回さない
+        print("⏱️ 実行予算切れ:", e, file=sys.stderr)
+        raise
     except Exception as e:
-        msg = str(e).lower()
-        if "duplicate" in msg:
+        if is_duplicate_error(e):
+            # 単発投稿のみ（スレッド途中の重複は ThreadDuplicateError になり、posted にはしない）
             print("✅ 重複検知：スキップ扱い（posted に更新）")
-            await mark_posted(n, page["id"])
-            return
-        print("❌ 投稿失敗:", e)
+            await mark_posted(n, item.id, deadline)
+            return "duplicate"
+        if not (is_rejected(e) or isinstance(e, ThreadDuplicateError)):
+            # 認証切れ・レート制限・5xx・通信エラーや、送信後の Notion 更新の失敗はページのせいではない。
+            # 試行回数を消費させず、Status もそのままにして次回の実行に任せる
+            print("❌ 投稿失敗（ページには記録しません）:", e)
+            raise
+        print("❌ 投稿失敗（本文が拒否されました）:", e)
+        # 失敗をページに記録して retry / dead に移し、次回以降は後続の ready を先に流す
+        try:
+            status, attempts = await mark_failed(n, item, f"{type(e).__name__}: {e}", deadline)
+            if status == STATUS_DEAD:
+                print(f"☠️ {attempts} 回失敗したため {status} に移動しました")
+            else:
+                print(f"🔁 {status} に移動（{attempts} 回目の失敗）")
+        except Exception as me:
+            print(f"⚠️ 失敗の記録に失敗: {me}", file=sys.stderr)
         raise
     finally:
         await cast(Any, n).aclose()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Notion の投稿キューから 1 件を X に投稿")
+    parser.add_argument(
+        "--deadline", default=os.getenv("RUN_DEADLINE"),
+        help="実行全体の締め切り（例: 90s, 2m）。未指定なら無制限",
+    )
+    args = parser.parse_args()
+    asyncio.run(main(Deadline.parse(args.deadline)))
@@ -0,0 +1,220 @@
+# similarity.py
+"""
+投稿文の近似重複検知（MinHash + LSH）
+
+- 正規化: NFKC・小文字化、URL/ハッシュタグ/記号/空白を除去
+- 文字 n-gram を shingle とし、numpy でまとめて MinHash 署名を計算
+- 署名を band に分けて LSH バケットに入れ、候補だけを署名で照合
+- 署名は npz ファイルに保存・読み込みでき、実行のたびに全件を計算し直さなくてよい
+"""
+
+import json
+import os
+import re
+import unicodedata
+import zlib
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+NUM_PERM = 128
+# 閾値ちょうどの類似度のペアが LSH の候補に上がる確率の下限（band 数の選択に使う）
+MIN_RECALL = 0.9
+SHINGLE = 3
+SEED = 1
+_PRIME = np.uint64((1 << 31) - 1)
+
+_URL = re.compile(r"https?://[\x21-\x7e]+")  # 直後に日本語が続いてもそこで終わる
+# 日本語は単語間に空白がないので、タグは「同じ文字種が続く範囲」までとみなす
+# （記号・空白・文字種の切り替わりで終わる。例: '#朝活今日は' → '#朝活今日' だけを除去）
+_HASHTAG = re.compile(
+    r"#(?:[a-z0-9_]+|[\u3041-\u309f]+|[\u30a0-\u30ffー]+|[\u3400-\u9fff々〆]+)"
+)
+_NOISE = re.compile(r"[\W_]+", re.UNICODE)
+
+def normalize(text: str) -> str:
+    s = unicodedata.normalize("NFKC", text).lower()  # NFKC で '＃' も '#' になる
+    s = _URL.sub("", s)
+    stripped = _NOISE.sub("", _HASHTAG.sub("", s))
+    # タグだけの投稿などで何も残らない場合は、タグも本文として扱う
+    return stripped or _NOISE.sub("", s)
+
+def shingles(text: str, k: int = SHINGLE) -> np.ndarray:
+    """文字 k-gram を crc32 で 32bit 整数化（重複除去済み）"""
+    s = normalize(text)
+    if not s:
+        return np.empty(0, dtype=np.uint64)
+    grams = {s[i:i + k] for i in range(max(1, len(s) - k + 1))}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+class MinHasher:
+    """(a*x + b) mod p のハッシュ族で MinHash 署名を作る（p = 2^31-1、uint64 内で溢れない）"""
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = SEED):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(1, int(_PRIME), size=(num_perm, 1), dtype=np.uint64)
+        self.b = rng.integers(0, int(_PRIME), size=(num_perm, 1), dtype=np.uint64)
+
+    def signatures(self, texts: Sequence[str], batch: int = 512) -> np.ndarray:
+        """
+        texts 全件の署名を (len(texts), num_perm) の uint32 配列で返す。
+        batch 件ごとに全 shingle を連結してまとめてハッシュし、
+        reduceat で文書ごとの最小値を取る（中間配列は num_perm x shingle 数）。
+        """
+        if len(texts) <= batch:
+            return self._signatures(texts)
+        return np.concatenate([self._signatures(texts[i:i + batch]) for i in range(0, len(texts), batch)])
+
+    def _signatures(self, texts: Sequence[str]) -> np.ndarray:
+        out = np.full((len(texts), self.num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+        parts = [shingles(t) for t in texts]
+        lens = np.array([len(p) for p in parts], dtype=np.int64)
+        nonempty = np.flatnonzero(lens)
+        if not len(nonempty):
+            return out
+        allsh = np.concatenate([parts[i] for i in nonempty])
+        # crc32 は 32bit なので a*x < 2^63 に収まる
+        hv = (self.a * (allsh[np.newaxis, :] % _PRIME) + self.b) % _PRIME
+        starts = np.concatenate(([0], np.cumsum(lens[nonempty])[:-1]))
+        out[nonempty] = np.minimum.reduceat(hv, starts, axis=1).T.astype(np.uint32)
+        return out
+
+def lsh_bands(threshold: float, num_perm: int = NUM_PERM, recall: float = MIN_RECALL) -> int:
+    """
+    類似度 threshold のペアが候補に上がる確率 1-(1-t^r)^b が recall 以上になる band 数 b のうち、
+    1 band の行数 r が最大（候補が最も少ない）もの。例: 0.8 → 16x8、0.6〜0.75 → 32x4、0.5 → 64x2
+    """
+    for rows in sorted((r for r in range(1, num_perm + 1) if num_perm % r == 0), reverse=True):
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands >= recall:
+            return bands
+    return num_perm
+
+def jaccard_estimate(sig_a: np.ndarray, sig_b: np.ndarray) -> np.ndarray:
+    """署名の一致率 = Jaccard 類似度の推定値（sig_b は 2 次元でも可）"""
+    return np.mean(sig_a == sig_b, axis=-1)
+
+class LSHIndex:
+    """
+    MinHash 署名の LSH インデックス。
+    query は band ごとの辞書引きで候補を集め、候補だけを署名で照合する。
+    同じキーの add は上書き、remove は墓標（keys[i] = None）にして save 時に詰める。
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = NUM_PERM, bands: Optional[int] = None):
+        bands = bands or lsh_bands(threshold, num_perm)
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.keys: List[Optional[Hashable]] = []
+        self._sigs: List[np.ndarray] = []
+        self._pos: Dict[Hashable, int] = {}
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+        # save / load で一緒に保存する任意の値（同期時刻など）
+        self.meta: Dict[str, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self._pos)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._pos
+
+    def _bands(self, sig: np.ndarray) -> Iterable[Tuple[int, bytes]]:
+        for b in range(self.bands):
+            yield b, sig[b * self.rows:(b + 1) * self.rows].tobytes()
+
+    def _insert(self, key: Hashable, sig: np.ndarray) -> None:
+        self.remove(key)
+        idx = len(self.keys)
+        self.keys.append(key)
+        self._sigs.append(sig)
+        self._pos[key] = idx
+        for b, h in self._bands(sig):
+            self._buckets[b].setdefault(h, []).append(idx)
+
+    def add_many(self, items: Iterable[Tuple[Hashable, str]]) -> None:
+        items = list(items)
+        if not items:
+            return
+        sigs = self.hasher.signatures([t for _, t in items])
+        for (key, text), sig in zip(items, sigs):
+            if not normalize(text):
+                self.remove(key)
+                continue
+            self._insert(key, sig)
+
+    def add(self, key: Hashable, text: str) -> None:
+        self.add_many([(key, text)])
+
+    def remove(self, key: Hashable) -> None:
+        idx = self._pos.pop(key, None)
+        if idx is not None:
+            # バケットからは消さず、照合時に飛ばす
+            self.keys[idx] = None
+
+    def query_signature(self, sig: np.ndarray, exclude: Optional[Hashable] = None) -> List[Tuple[Hashable, float]]:
+        cand = set()
+        for b, h in self._bands(sig):
+            cand.update(self._buckets[b].get(h, ()))
+        cand = {i for i in cand if self.keys[i] is not None and self.keys[i] != exclude}
+        if not cand:
+            return []
+        idx = np.fromiter(cand, dtype=np.int64, count=len(cand))
+        scores = jaccard_estimate(sig, np.stack([self._sigs[i] for i in idx]))
+        hits = [(self.keys[i], float(s)) for i, s in zip(idx, scores) if s >= self.threshold]
+        return sorted(hits, key=lambda x: -x[1])
+
+    def query(self, text: str, exclude: Optional[Hashable] = None) -> List[Tuple[Hashable, float]]:
+        """text と類似度 threshold 以上の (key, 推定類似度) を類似度の高い順に返す"""
+        if not normalize(text):
+            return []
+        return self.query_signature(self.hasher.signatures([text])[0], exclude)
+
+    def duplicate_pairs(self) -> List[Tuple[Hashable, Hashable, float]]:
+        """インデックス内の近似重複ペアをすべて列挙する（一括スキャン用）"""
+        pairs = []
+        for key_a, i in self._pos.items():
+            for key, score in self.query_signature(self._sigs[i], exclude=key_a):
+                # (a, b) と (b, a) の両方が出るので片方だけ残す
+                if str(key_a) < str(key):
+                    pairs.append((key_a, key, score))
+        return sorted(pairs, key=lambda x: -x[2])
+
+    def save(self, path: str) -> None:
+        """
+        署名とキーを npz に保存する（キーは str にして保存）。
+        一時ファイルに書いてから置き換えるので、書き込み中に落ちても前回の内容が残る。
+        """
+        live = sorted(self._pos.values())
+        sigs = np.stack([self._sigs[i] for i in live]) if live else np.empty((0, self.hasher.num_perm), np.uint32)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                keys=np.array([str(self.keys[i]) for i in live], dtype=str),
+                sigs=sigs,
+                params=np.array([self.hasher.num_perm, self.bands, SEED, SHINGLE], dtype=np.int64),
+                meta=np.array(json.dumps(self.meta)),
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, threshold: float = 0.8) -> "LSHIndex":
+        """
+        save した npz から作り直す（署名は再計算せず、threshold に合う band 数でバケットだけ組み直す）。
+        署名の作り方（シード・n-gram 長）が今と違えば ValueError。
+        """
+        with np.load(path) as z:
+            num_perm, _, seed, shingle = (int(x) for x in z["params"])
+            if (seed, shingle) != (SEED, SHINGLE):
+                raise ValueError(f"{path}: signature parameters differ (seed={seed}, shingle={shingle})")
+            index = cls(threshold, num_perm)
+            index.meta = json.loads(str(z["meta"]))
+            for key, sig in zip(z["keys"].tolist(), z["sigs"]):
+                index._insert(key, sig)
+        return index
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+保持期間を過ぎた posted / duplicate / dead ページを退避し、投稿キュー DB から外す（コンパクション）。
+
+  python tools/archive_posted.py --retention-days 90 --out archive/posted.jsonl
+  python tools/archive_posted.py --retention-days 90 --archive-db <DB_ID>
+
+アーカイブ用 DB には Text / Status / ScheduledAt / PostedAt に加えて SourceId（テキスト）が要る。
+
+1. 保持期間より古いページ（posted は PostedAt、duplicate / dead は最終編集日時で判定）を 100 件ずつ取得し、
+   ローカル JSONL（ページ JSON をそのまま 1 行）かアーカイブ用 DB に書き出す
+2. 書き出し済みのページを投稿キュー DB 上でアーカイブする
+どちらの段階もチェックポイントに記録し、再実行時は続きから再開する。
+JSONL に書けたがチェックポイントに記録する前に落ちた分は、JSONL 側の ID を見て二重に書かない。
+アーカイブ用 DB への作成が失敗した分は、再実行時に SourceId（元ページ ID）で作成済みかを確かめてから作る。
+"""
+import argparse, asyncio, datetime, json, os, sys
+from typing import Any, Dict, List, Optional, Set
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception as e:
+    print(f"[WARN] dotenv not available; skipping .env loading ({e})")
+
+# Add parent directory to sys.path for absolute imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from notion_bulk import Checkpoint, call_with_retry, run_bounded
+from notion_queue import (
+    STATUS_DEAD, STATUS_DUPLICATE, STATUS_POSTED, _content_plain, archive_page, create_page,
+    iter_archived_pages, iter_pages, open_client,
+)
+
+def _date_start(page: dict, prop: str) -> Optional[str]:
+    date = (page.get("properties", {}).get(prop) or {}).get("date") or {}
+    return date.get("start")
+
+def _status(page: dict) -> str:
+    return ((page.get("properties", {}).get("Status") or {}).get("select") or {}).get("name") or STATUS_POSTED
+
+async def _has_archived_copy(n: Any, archive_db: str, pid: str) -> bool:
+    q = await call_with_retry(
+        n.databases.query, database_id=archive_db,
+        filter={"property": "SourceId", "rich_text": {"equals": pid}}, page_size=1,
+    )
+    return bool(q.get("results"))
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+async def run(args: argparse.Namespace) -> int:
+    token = (os.environ.get("NOTION_TOKEN") or "").strip()
+    db_id = (os.environ.get("NOTION_DB_ID") or "").strip()
+    if not (token and db_id):
+        print("[ERROR] Missing env: NOTION_TOKEN / NOTION_DB_ID", file=sys.stderr)
+        return 2
+    if not (args.out or args.archive_db):
+        print("[ERROR] --out か --archive-db のどちらかを指定してください", file=sys.stderr)
+        return 2
+
+    cutoff = (
+        datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=args.retention_days)
+    ).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+    # posted は投稿日時、duplicate / dead は PostedAt が無いので最後に更新された日時で古さを判定する
+    status_filter = {
+        "or": [
+            {"and": [
+                {"property": "Status", "select": {"equals": STATUS_POSTED}},
+                {"property": "PostedAt", "date": {"on_or_before": cutoff}},
+            ]},
+            *(
+                {"and": [
+                    {"property": "Status", "select": {"equals": status}},
+                    {"timestamp": "last_edited_time", "last_edited_time": {"on_or_before": cutoff}},
+                ]}
+                for status in (STATUS_DUPLICATE, STATUS_DEAD)
+            ),
+        ]
+    }
+
+    n = open_client(token)
+    ckpt = Checkpoint(args.checkpoint or (args.out or "archive") + ".checkpoint")
+    out = None
+    stats = {"copied": 0, "archived": 0, "failed": 0}
+    # 1 段階目で書き出したページ ID（2 段階目の対象）。ID だけなので数万件でも小さい
+    pending: List[str] = []
+    # JSONL に書き出し済みのページ ID（チェックポイントへの記録前に落ちた分もここで分かる）
+    written: Set[str] = set()
+    try:
+        if args.out:
+            os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+            broken_tail = False
+            if os.path.exists(args.out) and os.path.getsize(args.out):
+                written = {page["id"] for page in iter_archived_pages(args.out)}
+                broken_tail = not _ends_with_newline(args.out)
+            out = open(args.out, "a", encoding="utf-8")
+            if broken_tail:
+                # 前回が行の途中で落ちていたら、壊れた行と次の行がつながらないよう改行しておく
+                out.write("\n")
+
+        async def copy(page: Dict[str, Any]) -> None:
+            pid = page["id"]
+            if f"archived:{pid}" in ckpt:
+                return
+            if f"copied:{pid}" not in ckpt:
+                if args.dry_run:
+                    print(f"[DRY-RUN] {pid} Status={_status(page)} PostedAt={_date_start(page, 'PostedAt')}")
+                    return
+                try:
+                    if out and pid not in written:
+                        out.write(json.dumps(page, ensure_ascii=False) + "\n")
+                        out.flush()
+                        written.add(pid)
+                    # 前回作成を試みたページは、作成済み（応答が返る前に失敗した）でないかを SourceId で確かめる
+                    if args.archive_db and not (
+                        f"copying:{pid}" in ckpt and await _has_archived_copy(n, args.archive_db, pid)
+                    ):
+                        ckpt.add(f"copying:{pid}")
+                        # 作成は冪等でないので 429 以外では再送しない（失敗分は再実行で確かめてから作る）
+                        await call_with_retry(
+                            create_page, n, args.archive_db,
+                            _content_plain(page.get("properties", {})),
+                            _date_start(page, "ScheduledAt"), _status(page),
+                            _date_start(page, "PostedAt"),
+                            source_id=pid,
+                            idempotent=False,
+                        )
+                except Exception as e:
+                    print(f"[ERROR] {pid}: 書き出し失敗: {e}", file=sys.stderr)
+                    stats["failed"] += 1
+                    return
+                ckpt.add(f"copied:{pid}")
+                stats["copied"] += 1
+            pending.append(pid)
+
+        print(f"[INFO] {cutoff} 以前の posted / duplicate / dead ページを書き出し中...")
+        # 取得中に DB を変更するとカーソルがずれるので、アーカイブは全件書き出した後に行う
+        await run_bounded(iter_pages(n, db_id, filter=status_filter), copy, concurrency=args.concurrency)
+
+        async def archive(pid: str) -> None:
+            try:
+                await call_with_retry(archive_page, n, pid)
+            except Exception as e:
+                print(f"[ERROR] {pid}: アーカイブ失敗: {e}", file=sys.stderr)
+                stats["failed"] += 1
+                return
+            ckpt.add(f"archived:{pid}")
+            stats["archived"] += 1
+            if stats["archived"] % 100 == 0:
+                print(f"[INFO] {stats['archived']} 件アーカイブ済み")
+
+        if not args.dry_run:
+            await run_bounded(pending, archive, concurrency=args.concurrency)
+        print(f"[INFO] 完了 copied={stats['copied']} archived={stats['archived']} failed={stats['failed']}")
+        return 1 if stats["failed"] else 0
+    finally:
+        if out:
+            out.close()
+        ckpt.close()
+        await n.aclose()
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="古い posted / duplicate / dead ページの退避とアーカイブ")
+    p.add_argument("--retention-days", type=int, default=90, help="投稿キューに残す日数（既定 90）")
+    p.add_argument("--out", help="退避先の JSONL ファイル（追記）")
+    p.add_argument("--archive-db", help="退避先の Notion データベース ID")
+    p.add_argument("--concurrency", type=int, default=3, help="同時リクエスト数（既定 3）")
+    p.add_argument("--checkpoint", help="チェックポイントファイル（既定 <out>.checkpoint）")
+    p.add_argument("--dry-run", action="store_true", help="対象ページを表示するだけで変更しない")
+    sys.exit(asyncio.run(run(p.parse_args())))
+
+if __name__ == "__main__":
+    main()
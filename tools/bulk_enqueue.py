@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSONL / CSV から Notion の投稿キューへ一括登録する。
+
+  python tools/bulk_enqueue.py calendar.jsonl --concurrency 3
+
+- 1 行 1 件（キー: text / ScheduledAt / Status。小文字・snake_case も可）
+- 既存ページと同じ本文（content_hash 一致）は作成しない
+  （tools/archive_posted.py で退避したページも --archive / --archive-db で照合対象にできる）
+- 作成済みの行はチェックポイントに記録し、再実行時は続きから再開
+"""
+import argparse, asyncio, csv, json, os, sys
+from typing import Any, Dict, Iterator, Optional, Sequence, Set
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception as e:
+    print(f"[WARN] dotenv not available; skipping .env loading ({e})")
+
+# Add parent directory to sys.path for absolute imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from notion_client import AsyncClient
+from notion_bulk import Checkpoint, call_with_retry, run_bounded
+from notion_queue import STATUS_READY, content_hash, create_page, iter_archived_items, iter_items, open_client
+
+def _pick(row: Dict[str, Any], *keys: str) -> Optional[str]:
+    for k in keys:
+        v = row.get(k)
+        if v not in (None, ""):
+            return str(v)
+    return None
+
+def read_rows(path: str) -> Iterator[Dict[str, Any]]:
+    """入力ファイルを 1 行ずつ読む（全体をメモリに載せない）"""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+async def existing_hashes(
+    n: AsyncClient,
+    db_id: str,
+    archives: Sequence[str] = (),
+    archive_dbs: Sequence[str] = (),
+) -> Set[str]:
+    """投稿キュー DB と、退避先（JSONL / アーカイブ用 DB）にある本文のハッシュ"""
+    hashes: Set[str] = set()
+    for db in [db_id, *archive_dbs]:
+        async for item in iter_items(n, db):
+            if item.text:
+                hashes.add(content_hash(item.text))
+    for path in archives:
+        for archived in iter_archived_items(path):
+            if archived.text:
+                hashes.add(content_hash(archived.text))
+    return hashes
+
+async def run(args: argparse.Namespace) -> int:
+    token = (os.environ.get("NOTION_TOKEN") or "").strip()
+    db_id = (os.environ.get("NOTION_DB_ID") or "").strip()
+    if not (token and db_id):
+        print("[ERROR] Missing env: NOTION_TOKEN / NOTION_DB_ID", file=sys.stderr)
+        return 2
+
+    n = open_client(token)
+    ckpt = Checkpoint(args.checkpoint or args.input + ".checkpoint")
+    try:
+        print("[INFO] 既存ページの本文ハッシュを取得中...")
+        seen = await existing_hashes(n, db_id, args.archive, args.archive_db)
+        seen |= ckpt.done
+        print(f"[INFO] 既存 {len(seen)} 件をスキップ対象として読み込み")
+
+        stats = {"created": 0, "skipped": 0, "failed": 0}
+
+        def tasks() -> Iterator[Dict[str, Any]]:
+            for i, row in enumerate(read_rows(args.input), 1):
+                text = (_pick(row, "text", "Text") or "").strip()
+                if not text:
+                    print(f"[WARN] line {i}: text が空のためスキップ", file=sys.stderr)
+                    stats["skipped"] += 1
+                    continue
+                h = content_hash(text)
+                if h in seen:
+                    stats["skipped"] += 1
+                    continue
+                # 入力内の重複もここで弾く
+                seen.add(h)
+                yield {
+                    "line": i,
+                    "hash": h,
+                    "text": text,
+                    "scheduled_at": _pick(row, "ScheduledAt", "scheduled_at"),
+                    "status": _pick(row, "Status", "status") or STATUS_READY,
+                }
+
+        async def worker(item: Dict[str, Any]) -> None:
+            if args.dry_run:
+                print(f"[DRY-RUN] line {item['line']}: {item['text'][:40]}")
+                stats["created"] += 1
+                return
+            try:
+                # 作成は冪等でないので 429 以外では再試行しない（タイムアウト時は再実行で既存判定される）
+                page = await call_with_retry(
+                    create_page, n, db_id, item["text"], item["scheduled_at"], item["status"],
+                    idempotent=False,
+                )
+            except Exception as e:
+                print(f"[ERROR] line {item['line']}: 作成失敗: {e}", file=sys.stderr)
+                stats["failed"] += 1
+                return
+            ckpt.add(item["hash"], line=item["line"], page_id=page.get("id"))
+            stats["created"] += 1
+            if stats["created"] % 100 == 0:
+                print(f"[INFO] {stats['created']} 件作成済み")
+
+        await run_bounded(tasks(), worker, concurrency=args.concurrency)
+        print(f"[INFO] 完了 created={stats['created']} skipped={stats['skipped']} failed={stats['failed']}")
+        return 1 if stats["failed"] else 0
+    finally:
+        ckpt.close()
+        await n.aclose()
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Notion 投稿キューへの一括登録")
+    p.add_argument("input", help="JSONL または CSV ファイル")
+    p.add_argument("--concurrency", type=int, default=3, help="同時リクエスト数（既定 3）")
+    p.add_argument("--checkpoint", help="チェックポイントファイル（既定 <input>.checkpoint）")
+    p.add_argument("--archive", action="append", default=[], help="退避済み JSONL（archive_posted.py --out）。複数指定可")
+    p.add_argument("--archive-db", action="append", default=[], help="退避先の Notion データベース ID。複数指定可")
+    p.add_argument("--dry-run", action="store_true", help="作成せずに対象行だけ表示")
+    sys.exit(asyncio.run(run(p.parse_args())))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+障害注入プロファイルごとに post.main を繰り返し実行し、
+エンドツーエンドのレイテンシ分位点と結果の内訳を表示する。
+
+  python tools/fault_bench.py --profiles none,notion_throttled,degraded --runs 50
+  python tools/fault_bench.py --profiles x_slow --runs 20 --deadline 60s
+
+既定はオフライン（FAULT_OFFLINE=true: Notion / X / SSM をメモリ上のフェイクで代替）。
+--online を付けると実サービスに障害を注入して実行する（実際に投稿されるので staging 用）。
+"""
+import argparse, asyncio, contextlib, io, math, os, sys, time
+from collections import Counter
+from typing import List, Tuple
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception as e:
+    print(f"[WARN] dotenv not available; skipping .env loading ({e})")
+
+# Add parent directory to sys.path for absolute imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _percentile(xs: List[float], q: float) -> float:
+    """最近傍順位法の分位点（順位 = ceil(q/100 * N)）"""
+    s = sorted(xs)
+    return s[max(0, min(len(s) - 1, math.ceil(q / 100 * len(s)) - 1))]
+
+async def bench(profile: str, args: argparse.Namespace) -> Tuple[List[float], Counter, Counter]:
+    """戻り値: (レイテンシ秒のリスト, 結果ごとの件数, 注入した障害ごとの件数)"""
+    import fault_injection
+    import post
+    from deadline import Deadline, DeadlineExceeded
+
+    inj = fault_injection.configure(None if profile == "none" else profile, args.seed)
+    fault_injection.reset_fakes()
+
+    latencies: List[float] = []
+    outcomes: Counter = Counter()
+    for _ in range(args.runs):
+        sink = io.StringIO()
+        t0 = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+                outcome = await post.main(Deadline.parse(args.deadline))
+        except DeadlineExceeded:
+            outcome = "deadline"
+        except SystemExit as e:
+            outcome = f"exit:{e.code}"
+        except Exception as e:
+            outcome = f"error:{type(e).__name__}"
+        latencies.append(time.perf_counter() - t0)
+        outcomes[outcome] += 1
+        if args.verbose:
+            print(sink.getvalue(), end="")
+
+    return latencies, outcomes, (inj.counts if inj else Counter())
+
+async def run(args: argparse.Namespace) -> int:
+    if not args.online:
+        os.environ["FAULT_OFFLINE"] = "true"
+        os.environ.setdefault("FAULT_OFFLINE_PAGES", str(args.runs))
+        # config.py が import 時に要求する値（オフラインでは使われない）
+        for key in ("X_CLIENT_ID", "X_CLIENT_SECRET", "X_REDIRECT_URI", "NOTION_TOKEN", "NOTION_DB_ID"):
+            os.environ.setdefault(key, "offline")
+
+    mode = "online" if args.online else "offline"
+    print(f"{'profile':<18}{'runs':>5}{'p50':>8}{'p90':>8}{'p99':>8}{'max':>8}  outcomes / injected  ({mode})")
+    for profile in args.profiles.split(","):
+        lat, outcomes, injected = await bench(profile.strip(), args)
+        out_s = ", ".join(f"{k}={v}" for k, v in sorted(outcomes.items()))
+        inj_s = ", ".join(f"{s}/{k}={v}" for (s, k), v in sorted(injected.items()))
+        print(
+            f"{profile:<18}{len(lat):>5}"
+            f"{_percentile(lat, 50):>8.2f}{_percentile(lat, 90):>8.2f}"
+            f"{_percentile(lat, 99):>8.2f}{max(lat):>8.2f}"
+            f"  {out_s} / {inj_s or '-'}"
+        )
+    return 0
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="障害注入下での投稿パイプラインの計測")
+    p.add_argument("--profiles", default="none,degraded", help="カンマ区切りのプロファイル名 / JSON パス")
+    p.add_argument("--runs", type=int, default=20, help="プロファイルごとの実行回数（既定 20）")
+    p.add_argument("--deadline", default=os.getenv("RUN_DEADLINE"), help="post.py と同じ実行予算（例: 90s）")
+    p.add_argument("--seed", type=int, default=1, help="障害注入の乱数シード")
+    p.add_argument("--online", action="store_true", help="実サービスに対して実行（実際に投稿される）")
+    p.add_argument("-v", "--verbose", action="store_true", help="各実行のログも表示")
+    sys.exit(asyncio.run(run(p.parse_args())))
+
+if __name__ == "__main__":
+    main()
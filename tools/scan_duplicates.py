@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+投稿キュー（posted / ready / retry）全体の近似重複レポート。
+
+  python tools/scan_duplicates.py --threshold 0.8
+
+post.py と同じ署名キャッシュ（SIMILARITY_CACHE）を更新するので、初回の全件読み込みをここで済ませておける。
+アーカイブしたページはキャッシュにだけ残るため、キャッシュを作り直したときは --archive で退避済み JSONL を入れ直す。
+"""
+import argparse, asyncio, os, sys
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception as e:
+    print(f"[WARN] dotenv not available; skipping .env loading ({e})")
+
+# Add parent directory to sys.path for absolute imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from notion_queue import SIMILARITY_CACHE, STATUS_POSTED, iter_archived_items, load_similarity_index, open_client
+
+async def run(args: argparse.Namespace) -> int:
+    token = (os.environ.get("NOTION_TOKEN") or "").strip()
+    db_id = (os.environ.get("NOTION_DB_ID") or "").strip()
+    if not (token and db_id):
+        print("[ERROR] Missing env: NOTION_TOKEN / NOTION_DB_ID", file=sys.stderr)
+        return 2
+
+    n = open_client(token)
+    try:
+        index = await load_similarity_index(n, db_id, args.threshold, args.cache or None)
+    finally:
+        await n.aclose()
+    if args.archive:
+        for path in args.archive:
+            # 照合対象は posted だけ（duplicate / dead は投稿されていない）。キャッシュにあるページは Notion 側を優先する
+            index.add_many(
+                (item.id, item.text) for item in iter_archived_items(path)
+                if item.status == STATUS_POSTED and item.id not in index
+            )
+        if args.cache:
+            index.save(args.cache)
+
+    pairs = index.duplicate_pairs()
+    print(f"[INFO] {len(index)} 件中、近似重複ペア {len(pairs)} 組（threshold={args.threshold}）")
+    for a, b, score in pairs:
+        print(f"{score:.2f}\t{a}\t{b}")
+    return 0
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="投稿キューの近似重複レポート")
+    p.add_argument("--threshold", type=float, default=float(os.getenv("NEAR_DUP_THRESHOLD") or 0.8))
+    p.add_argument("--cache", default=SIMILARITY_CACHE, help="署名キャッシュのパス（空文字で使わない）")
+    p.add_argument("--archive", action="append", default=[], help="照合対象に加える退避済み JSONL。複数指定可")
+    sys.exit(asyncio.run(run(p.parse_args())))
+
+if __name__ == "__main__":
+    main()
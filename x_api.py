@@ -1,16 +1,154 @@
-from typing import Dict, Mapping, Any, Optional
+import functools, html, os, re
+from typing import Dict, Iterator, List, Mapping, Any, Optional, Tuple, Union
 import tweepy
 
-def client_from_access_token(access_token: str) -> tweepy.Client:
+import fault_injection
+
+# X の文字数は「重み付き長」で数える（CJK 等は 2、URL は一律 23）
+MAX_WEIGHTED_LENGTH = int(os.getenv("X_MAX_WEIGHTED_LENGTH", "280"))
+URL_WEIGHT = 23
+_WEIGHT1_RANGES = ((0, 4351), (8192, 8205), (8208, 8223), (8242, 8247))
+# URL は ASCII の表示可能文字の範囲まで（X と同じく、直後に日本語が続いてもそこで終わる）
+_URL = re.compile(r"https?://[\x21-\x7e]+")
+# 文の区切り（句点・感嘆符・疑問符の直後、または改行）
+_SENTENCE = re.compile(r"(?<=[。．！？!?])|(?<=\.)(?=\s)|(?<=\n)")
+
+def client_from_access_token(
+    access_token: str,
+    timeout: Optional[Union[float, Tuple[float, float]]] = None,
+) -> tweepy.Client:
+    if fault_injection.offline():
+        return fault_injection.wrap_x(fault_injection.fake_x())
     # OAuth2 ベアラでOK（user_auth=Falseで明示）
-    return tweepy.Client(access_token)
+    # 障害注入は送信層（session.request）に入るので、タイムアウトの差し込みより先に行う
+    client = fault_injection.wrap_x(tweepy.Client(access_token))
+    if timeout is not None:
+        # tweepy.Client は requests のタイムアウトを受け取らないので、セッションに既定値を差し込む
+        client.session.request = functools.partial(client.session.request, timeout=timeout)  # type: ignore[method-assign]
+    return client
+
+def _char_weight(ch: str) -> int:
+    cp = ord(ch)
+    return 1 if any(lo <= cp <= hi for lo, hi in _WEIGHT1_RANGES) else 2
+
+def _tokens(text: str) -> Iterator[Tuple[str, int]]:
+    """(トークン, 重み) を順に返す。URL は丸ごと 1 トークン（重み 23）、それ以外は 1 文字ずつ"""
+    pos = 0
+    for m in _URL.finditer(text):
+        for ch in text[pos:m.start()]:
+            yield ch, _char_weight(ch)
+        yield m.group(), URL_WEIGHT
+        pos = m.end()
+    for ch in text[pos:]:
+        yield ch, _char_weight(ch)
+
+def weighted_length(text: str) -> int:
+    return sum(w for _, w in _tokens(text))
+
+def _sentences(text: str) -> List[str]:
+    """文の区切りで分ける。URL 内の '?' や '!' では切らない"""
+    urls = [m.span() for m in _URL.finditer(text)]
+    cuts = [0]
+    for m in _SENTENCE.finditer(text):
+        i = m.start()
+        if i > cuts[-1] and not any(lo < i < hi for lo, hi in urls):
+            cuts.append(i)
+    cuts.append(len(text))
+    return [text[i:j] for i, j in zip(cuts, cuts[1:]) if i < j]
+
+def _pack_tokens(text: str, limit: int) -> List[str]:
+    """1 文が limit を超えるとき用。URL を途中で切らずに、トークン単位で limit 以下に詰める"""
+    pieces: List[str] = []
+    buf, w = "", 0
+    for tok, tw in _tokens(text):
+        if buf and w + tw > limit:
+            pieces.append(buf)
+            buf, w = "", 0
+        buf += tok
+        w += tw
+    if buf:
+        pieces.append(buf)
+    return pieces
+
+def split_for_thread(text: str, limit: int = MAX_WEIGHTED_LENGTH) -> List[str]:
+    """
+    text を重み付き長 limit 以下のセグメントに分ける。
+    文の区切りでまとめられるだけまとめ、1 文で limit を超える場合だけ文字単位で切る（URL は切らない）。
+    """
+    text = text.strip()
+    if weighted_length(text) <= limit:
+        return [text]
+
+    pieces: List[str] = []
+    for sentence in _sentences(text):
+        if weighted_length(sentence) <= limit:
+            pieces.append(sentence)
+        else:
+            pieces.extend(_pack_tokens(sentence, limit))
+
+    segments: List[str] = []
+    cur = ""
+    for piece in pieces:
+        if cur and weighted_length(cur + piece) > limit:
+            segments.append(cur.strip())
+            cur = ""
+        cur += piece
+    if cur.strip():
+        segments.append(cur.strip())
+
+    # 念のため全セグメントを重み付き長で確かめ、超えていればトークン単位で切り直す
+    out: List[str] = []
+    for seg in segments:
+        if weighted_length(seg) <= limit:
+            out.append(seg)
+        else:
+            out.extend(p.strip() for p in _pack_tokens(seg, limit))
+    return [s for s in out if s]
+
+def is_duplicate_error(e: Exception) -> bool:
+    """同じ本文を投稿済みとして X に拒否されたか（403 "duplicate content"）"""
+    return isinstance(e, tweepy.Forbidden) and "duplicate" in str(e).lower()
+
+def is_rejected(e: Exception) -> bool:
+    """
+    本文そのものが X に拒否されたか（400 / 403）。
+    認証切れ（401）・レート制限（429）・5xx・通信エラーはページのせいではないので含まない。
+    """
+    return isinstance(e, (tweepy.BadRequest, tweepy.Forbidden))
+
+def find_sent_tweet(client: tweepy.Client, text: str, in_reply_to: Optional[str] = None) -> Optional[str]:
+    """
+    送信は済んだのに応答（ID）を受け取れなかったツイートを、自分の最近のツイートから探して ID を返す。
+    in_reply_to があればそのツイートへの返信を、なければ本文で照合する（URL は t.co に置き換わるので除く）。
+    """
+    me = client.get_me(user_auth=False)
+    user_id = getattr(getattr(me, "data", None), "id", None)
+    if not user_id:
+        return None
+    resp = client.get_users_tweets(
+        user_id, max_results=20, since_id=in_reply_to,
+        tweet_fields=["referenced_tweets"], user_auth=False,
+    )
+    want = _URL.sub("", text).strip()
+    for tweet in getattr(resp, "data", None) or []:
+        if in_reply_to:
+            refs = getattr(tweet, "referenced_tweets", None) or []
+            if any(getattr(r, "type", None) == "replied_to" and str(getattr(r, "id", "")) == str(in_reply_to) for r in refs):
+                return str(tweet.id)
+        elif _URL.sub("", html.unescape(getattr(tweet, "text", "") or "")).strip() == want:
+            return str(tweet.id)
+    return None
 
-def create_text_tweet(client: tweepy.Client, text: str) -> Dict[str, Any]:
+def create_text_tweet(client: tweepy.Client, text: str, in_reply_to: Optional[str] = None) -> Dict[str, Any]:
     """
     TweepyのResponse型に依存せず、常に Dict を返す。
+    in_reply_to を渡すとそのツイートへの返信（スレッドの続き）として投稿する。
     返り値: {"id": Optional[str], "data": Optional[Mapping], "raw": Response}
     """
-    resp = client.create_tweet(text=text, user_auth=False)
+    if in_reply_to:
+        resp = client.create_tweet(text=text, in_reply_to_tweet_id=in_reply_to, user_auth=False)
+    else:
+        resp = client.create_tweet(text=text, user_auth=False)
     data: Optional[Mapping[str, Any]] = getattr(resp, "data", None)
     tweet_id: Optional[str] = None
     if isinstance(data, Mapping):